@@ -0,0 +1,314 @@
+import argparse
+import logging
+import math
+from collections import namedtuple
+
+import numpy as np
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+from app.models import Operator, OperatorCompetence, LeadContact, Source
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ["new", "in_progress"]
+
+# Матрица настроек распределения в плотных индексах:
+# строки - источники, столбцы - операторы (оба упорядочены по id).
+# order - порядок строк operator_competences: в нем get_available_operators
+# перечисляет операторов, и первого из них select_operator берет при нулевых весах
+Config = namedtuple("Config", ["source_ids", "operator_ids", "weights", "competent", "max_load", "active", "order"])
+
+NOT_COMPETENT = np.iinfo(np.int64).max
+
+# История обращений: индексы источника и оператора (-1 - без оператора) и флаг открытости
+History = namedtuple("History", ["source_idx", "operator_idx", "is_open"])
+
+
+def load_config(db: Session):
+    """Загрузить компетенции и операторов в массивы NumPy"""
+    source_ids = np.array(db.execute(select(Source.id).order_by(Source.id)).scalars().all(), dtype=np.int64)
+    operator_rows = db.execute(
+        select(Operator.id, Operator.max_load, Operator.is_active).order_by(Operator.id)
+    ).all()
+    operator_ids = np.array([row[0] for row in operator_rows], dtype=np.int64)
+    max_load = np.array([row[1] or 0 for row in operator_rows], dtype=np.int64)
+    active = np.array([bool(row[2]) for row in operator_rows], dtype=bool)
+
+    weights = np.zeros((len(source_ids), len(operator_ids)), dtype=np.float64)
+    competent = np.zeros(weights.shape, dtype=bool)
+    order = np.full(weights.shape, NOT_COMPETENT, dtype=np.int64)
+    rows = np.array(db.execute(select(
+        OperatorCompetence.source_id, OperatorCompetence.operator_id,
+        func.coalesce(OperatorCompetence.weight, 0)
+    ).order_by(OperatorCompetence.id)).all(), dtype=np.int64).reshape(-1, 3)
+    s_idx, s_ok = _dense_index(source_ids, rows[:, 0])
+    o_idx, o_ok = _dense_index(operator_ids, rows[:, 1])
+    ok = s_ok & o_ok
+    weights[s_idx[ok], o_idx[ok]] = rows[ok, 2]
+    competent[s_idx[ok], o_idx[ok]] = True
+    # Внутри источника важен только относительный порядок - хватает номера строки
+    order[s_idx[ok], o_idx[ok]] = np.flatnonzero(ok)
+
+    return Config(source_ids, operator_ids, weights, competent, max_load, active, order)
+
+
+def load_history(db: Session, config: Config, chunk_size: int = 100000):
+    """Прочитать из lead_contacts только нужные колонки, пачками, сразу в массивы"""
+    stmt = select(
+        LeadContact.source_id,
+        func.coalesce(LeadContact.operator_id, -1),
+        case((LeadContact.status.in_(OPEN_STATUSES), 1), else_=0)
+    )
+    parts = []
+    result = db.execute(stmt.execution_options(yield_per=chunk_size))
+    for partition in result.partitions():
+        parts.append(np.array(partition, dtype=np.int64))
+    rows = np.concatenate(parts) if parts else np.empty((0, 3), dtype=np.int64)
+
+    source_idx, source_ok = _dense_index(config.source_ids, rows[:, 0])
+    operator_idx, operator_ok = _dense_index(config.operator_ids, rows[:, 1])
+    operator_idx[~operator_ok] = -1
+    return History(np.where(source_ok, source_idx, -1), operator_idx, rows[:, 2].astype(bool))
+
+
+def _dense_index(sorted_ids, values):
+    """Перевести id в индексы отсортированного массива id и отметить найденные"""
+    idx = np.searchsorted(sorted_ids, values)
+    idx = np.minimum(idx, max(len(sorted_ids) - 1, 0))
+    found = (sorted_ids[idx] == values) if len(sorted_ids) else np.zeros(len(values), dtype=bool)
+    return idx, found
+
+
+def chi2_sf(statistic: float, dof: int):
+    """Хвост распределения хи-квадрат (аппроксимация Уилсона-Хилферти)"""
+    if dof <= 0:
+        return 1.0
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def assignment_counts(config: Config, history: History):
+    """Матрица числа обращений источник x оператор"""
+    n_sources, n_operators = config.weights.shape
+    assigned = (history.source_idx >= 0) & (history.operator_idx >= 0)
+    flat = history.source_idx[assigned] * n_operators + history.operator_idx[assigned]
+    return np.bincount(flat, minlength=n_sources * n_operators).reshape(n_sources, n_operators)
+
+
+def open_load(config: Config, history: History):
+    """Текущая нагрузка операторов (обращения в статусах new/in_progress)"""
+    mask = history.is_open & (history.operator_idx >= 0)
+    return np.bincount(history.operator_idx[mask], minlength=len(config.operator_ids))
+
+
+def fairness_report(config: Config, history: History):
+    """Сравнить фактическое распределение с весами по каждому источнику"""
+    counts = assignment_counts(config, history)
+    load = open_load(config, history)
+    unassigned = np.bincount(
+        history.source_idx[(history.source_idx >= 0) & (history.operator_idx < 0)],
+        minlength=len(config.source_ids)
+    )
+
+    # Ожидаемые доли - веса активных операторов с компетенцией
+    expected_weights = np.where(config.competent & config.active, config.weights, 0.0)
+    totals = expected_weights.sum(axis=1, keepdims=True)
+    expected_share = np.divide(expected_weights, totals, out=np.zeros_like(expected_weights), where=totals > 0)
+
+    observed_total = counts.sum(axis=1)
+    expected = expected_share * observed_total[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = np.where(expected > 0, (counts - expected) ** 2 / expected, 0.0)
+        observed_share = np.where(observed_total[:, None] > 0, counts / observed_total[:, None], 0.0)
+    chi2 = terms.sum(axis=1)
+    dof = (expected > 0).sum(axis=1) - 1
+    # Обращения к операторам без веса по текущим настройкам (например, выключенным)
+    off_weight = np.where(expected_weights > 0, 0, counts).sum(axis=1)
+
+    report = []
+    for s, source_id in enumerate(config.source_ids):
+        report.append({
+            'source_id': int(source_id),
+            'contacts': int(observed_total[s] + unassigned[s]),
+            'unassigned': int(unassigned[s]),
+            'off_weight': int(off_weight[s]),
+            'chi2': float(chi2[s]),
+            'dof': int(max(dof[s], 0)),
+            'p_value': chi2_sf(float(chi2[s]), int(dof[s])),
+            'max_share_deviation': float(np.abs(observed_share[s] - expected_share[s]).max(initial=0.0))
+                                   if observed_total[s] else 0.0,
+            'operators': {
+                int(config.operator_ids[o]): {
+                    'expected_share': float(expected_share[s, o]),
+                    'observed_share': float(observed_share[s, o]),
+                    'assigned': int(counts[s, o])
+                }
+                for o in np.flatnonzero(config.competent[s] | (counts[s] > 0))
+            }
+        })
+
+    utilization = np.divide(load, config.max_load, out=np.zeros(len(load)), where=config.max_load > 0)
+    return report, {int(op): float(u) for op, u in zip(config.operator_ids, utilization)}
+
+
+def simulate(config: Config, initial_load, source_mix, contacts: int = 1000,
+             runs: int = 1000, seed: int = None, completion_rate: float = 0.0):
+    """Монте-Карло для select_operator: все прогоны шагают одновременно.
+
+    completion_rate - вероятность, что открытое обращение закроется за время
+    между двумя новыми обращениями (среднее время обработки 1 / completion_rate
+    обращений). При 0 нагрузка только растет и моделируется заполнение емкости.
+    """
+    n_sources, n_operators = config.weights.shape
+    if n_sources == 0:
+        raise ValueError("Нет источников - моделировать нечего")
+    rng = np.random.default_rng(seed)
+    load = np.tile(np.asarray(initial_load, dtype=np.int64), (runs, 1))
+    assigned = np.zeros((runs, n_operators), dtype=np.int64)
+    unassigned = np.zeros(runs, dtype=np.int64)
+    run_idx = np.arange(runs)
+
+    # Поток обращений: источники в пропорции наблюдаемого потока
+    arrivals = rng.choice(n_sources, size=(runs, contacts), p=source_mix)
+    draws = rng.random((runs, contacts))
+    eligible = config.competent & config.active
+
+    for t in range(contacts):
+        if completion_rate > 0:
+            load -= rng.binomial(load, completion_rate)
+        s = arrivals[:, t]
+        # Как в get_available_operators: компетенция, активность, запас по лимиту
+        available = eligible[s] & (load < config.max_load)
+        weights = np.where(available, config.weights[s], 0.0)
+        cumulative = np.cumsum(weights, axis=1)
+        total = cumulative[:, -1] if n_operators else np.zeros(runs)
+
+        # Как в select_operator: первый оператор, у которого накопленный вес >= случайного
+        threshold = draws[:, t] * total
+        chosen = np.argmax((cumulative >= threshold[:, None]) & available, axis=1)
+        # При нулевом суммарном весе select_operator берет первого доступного
+        # в порядке строк компетенций, а не по id оператора
+        first_available = np.argmin(np.where(available, config.order[s], NOT_COMPETENT), axis=1)
+        chosen = np.where(total > 0, chosen, first_available)
+
+        has_operator = available.any(axis=1)
+        hit = run_idx[has_operator]
+        load[hit, chosen[has_operator]] += 1
+        assigned[hit, chosen[has_operator]] += 1
+        unassigned += ~has_operator
+
+    return {
+        'assigned_share': assigned.mean(axis=0) / contacts,
+        'unassigned_rate': float(unassigned.mean() / contacts),
+        'unassigned_p95': float(np.percentile(unassigned, 95) / contacts),
+        'final_utilization': np.divide(
+            load.mean(axis=0), config.max_load,
+            out=np.zeros(n_operators), where=config.max_load > 0
+        )
+    }
+
+
+def with_changes(config: Config, max_load=None, weights=None):
+    """Копия настроек с предлагаемыми изменениями: {operator_id: max_load}, {(operator_id, source_id): weight}"""
+    new_max_load = config.max_load.copy()
+    new_weights = config.weights.copy()
+    new_competent = config.competent.copy()
+    new_order = config.order.copy()
+    next_order = int(config.order[config.competent].max(initial=-1)) + 1
+    for operator_id, value in (max_load or {}).items():
+        o, ok = _dense_index(config.operator_ids, np.array([operator_id]))
+        if not ok[0]:
+            raise ValueError(f"Оператор {operator_id} не найден")
+        new_max_load[o[0]] = value
+    for (operator_id, source_id), value in (weights or {}).items():
+        o, o_ok = _dense_index(config.operator_ids, np.array([operator_id]))
+        s, s_ok = _dense_index(config.source_ids, np.array([source_id]))
+        if not (o_ok[0] and s_ok[0]):
+            raise ValueError(f"Пара оператор {operator_id} / источник {source_id} не найдена")
+        new_weights[s[0], o[0]] = value
+        if not new_competent[s[0], o[0]]:
+            # Новая компетенция - новая строка в конце таблицы
+            new_competent[s[0], o[0]] = True
+            new_order[s[0], o[0]] = next_order
+            next_order += 1
+    return config._replace(max_load=new_max_load, weights=new_weights, competent=new_competent, order=new_order)
+
+
+def source_mix(config: Config, history: History):
+    """Доли источников в наблюдаемом потоке обращений"""
+    counts = np.bincount(history.source_idx[history.source_idx >= 0], minlength=len(config.source_ids))
+    if len(counts) == 0:
+        return np.empty(0)
+    if counts.sum() == 0:
+        return np.full(len(config.source_ids), 1 / len(config.source_ids))
+    return counts / counts.sum()
+
+
+def _parse_pairs(values, key_parts):
+    result = {}
+    for item in values or []:
+        key, value = item.split("=")
+        parts = tuple(int(part) for part in key.split(":"))
+        result[parts if key_parts > 1 else parts[0]] = int(value)
+    return result
+
+
+def _print_audit(report, utilization):
+    print(f"{'источник':>9}{'обращений':>11}{'без опер.':>11}{'chi2':>10}{'p':>8}{'макс. откл.':>13}")
+    for row in report:
+        print(f"{row['source_id']:>9}{row['contacts']:>11}{row['unassigned']:>11}"
+              f"{row['chi2']:>10.2f}{row['p_value']:>8.3f}{row['max_share_deviation']:>13.3f}")
+    print("\nЗагрузка операторов:")
+    for operator_id, value in utilization.items():
+        print(f"   оператор {operator_id}: {value * 100:.1f}%")
+
+
+def _print_simulation(label, config, result):
+    print(f"\n{label}: без оператора {result['unassigned_rate'] * 100:.2f}% "
+          f"(p95 {result['unassigned_p95'] * 100:.2f}%)")
+    for o, operator_id in enumerate(config.operator_ids):
+        share = result['assigned_share'][o]
+        print(f"   оператор {operator_id}: доля {share * 100:.1f}%, "
+              f"загрузка в конце {result['final_utilization'][o] * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    import time
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Аудит весов распределения и what-if планирование")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("audit", help="Отклонение фактического распределения от весов")
+    whatif = commands.add_parser("whatif", help="Монте-Карло при измененных настройках")
+    whatif.add_argument("--max-load", action="append", metavar="OPERATOR=N")
+    whatif.add_argument("--weight", action="append", metavar="OPERATOR:SOURCE=W")
+    whatif.add_argument("--contacts", type=int, default=1000, help="Обращений в одном прогоне")
+    whatif.add_argument("--runs", type=int, default=1000, help="Число прогонов")
+    whatif.add_argument("--service-time", type=float, default=50,
+                        help="Среднее время обработки обращения в числе новых обращений (0 - не закрывать)")
+    whatif.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        config = load_config(db)
+        history = load_history(db, config)
+    finally:
+        db.close()
+    print(f"Загружено обращений: {len(history.source_idx)} за {time.perf_counter() - started:.2f} с\n")
+
+    if args.command == "audit":
+        _print_audit(*fairness_report(config, history))
+    elif len(config.source_ids) == 0 or len(config.operator_ids) == 0:
+        print("Нечего моделировать: нет источников или операторов")
+    else:
+        proposed = with_changes(config, _parse_pairs(args.max_load, 1), _parse_pairs(args.weight, 2))
+        mix, load = source_mix(config, history), open_load(config, history)
+        rate = 1 / args.service_time if args.service_time > 0 else 0.0
+        started = time.perf_counter()
+        _print_simulation("Текущие настройки", config,
+                          simulate(config, load, mix, args.contacts, args.runs, args.seed, rate))
+        _print_simulation("Предлагаемые настройки", proposed,
+                          simulate(proposed, load, mix, args.contacts, args.runs, args.seed, rate))
+        print(f"\nСмоделировано {2 * args.runs} сценариев за {time.perf_counter() - started:.2f} с")
@@ -73,7 +73,8 @@ def get_source_competences(db: Session, source_id: int):
 
 # Просмотр состояния
 def get_leads_with_contacts(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(Lead).offset(skip).limit(limit).all()
+    # Слитые дублями лиды обращений не имеют - показываем только канонических
+    return db.query(Lead).filter(Lead.merged_into_id.is_(None)).offset(skip).limit(limit).all()
 
 def get_operator_stats(db: Session, operator_id: int):
     operator = db.query(Operator).filter(Operator.id == operator_id).first()
@@ -1,19 +1,104 @@
-from sqlalchemy import create_engine
+import os
+import tempfile
+import threading
+import logging
+from contextlib import contextmanager
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./leads.db"
+try:
+    import fcntl
+except ImportError:  # Windows - межпроцессной блокировки нет
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./leads.db")
+SCHEMA_LOCK_PATH = os.getenv(
+    "SCHEMA_LOCK_PATH", os.path.join(tempfile.gettempdir(), "lead_crm_schema.lock")
+)
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+_schema_lock = threading.Lock()
+_schema_ready = False
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+@contextmanager
+def _interprocess_lock(path: str):
+    """Файловая блокировка, общая для всех воркеров uvicorn на машине"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _upgrade_tables(bind, inspector, table_names):
+    """Добавить в существующие таблицы недостающие колонки и индексы из моделей"""
+    changed = False
+    for name in table_names:
+        table = Base.metadata.tables[name]
+        columns = {column['name'] for column in inspector.get_columns(name)}
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            if not column.nullable:
+                raise RuntimeError(
+                    f"В таблице {name} нет обязательной колонки {column.name} - нужна ручная миграция"
+                )
+            logger.info(f"Добавление колонки {name}.{column.name}")
+            with bind.begin() as connection:
+                connection.execute(text(
+                    f"ALTER TABLE {name} ADD COLUMN {column.name} {column.type.compile(dialect=bind.dialect)}"
+                ))
+            changed = True
+
+        indexes = {index['name'] for index in inspector.get_indexes(name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                # На большой таблице построение индекса займет время, но один раз
+                logger.info(f"Создание индекса {index.name}")
+                index.create(bind=bind)
+                changed = True
+    return changed
+
+def init_db(bind=None):
+    """Проверить схему, создать недостающие таблицы и колонки один раз на процесс"""
+    global _schema_ready
+    # Таблицы регистрируются в Base.metadata при импорте моделей -
+    # без этого импорта create_all не увидел бы ни одной таблицы
+    import app.models  # noqa: F401
+    bind = bind or engine
+    with _schema_lock:
+        if _schema_ready:
+            return False
+        # Воркеры стартуют одновременно - создает таблицы только первый,
+        # остальные дожидаются его и видят готовую схему одним запросом
+        with _interprocess_lock(SCHEMA_LOCK_PATH):
+            inspector = inspect(bind)
+            existing = set(inspector.get_table_names())
+            missing = [name for name in Base.metadata.tables if name not in existing]
+            if missing:
+                logger.info(f"Создание таблиц: {missing}")
+                Base.metadata.create_all(bind=bind)
+            # Базы со старой схемой догоняем добавлением nullable-колонок и индексов
+            upgraded = _upgrade_tables(bind, inspector, [name for name in Base.metadata.tables if name in existing])
+        _schema_ready = True
+        return bool(missing) or upgraded
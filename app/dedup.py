@@ -0,0 +1,196 @@
+import argparse
+import logging
+from array import array
+
+from sqlalchemy import bindparam, func
+from sqlalchemy.orm import Session
+from app.models import Lead, LeadContact
+
+logger = logging.getLogger(__name__)
+
+# Поля, по которым лиды считаются одним человеком.
+# external_id уникален в таблице leads, поэтому сам по себе дублей не связывает -
+# связи между разными external_id появляются только через общий phone/email.
+LINK_COLUMNS = (Lead.phone, Lead.email)
+
+
+class LeadUnionFind:
+    """Система непересекающихся множеств над id лидов в плотном массиве"""
+
+    def __init__(self, max_id: int):
+        # Индекс массива - это id лида. Неотрицательное значение - id родителя,
+        # отрицательное - лид является корнем, а -значение равно размеру компоненты.
+        # 4 байта на лида, пока id помещаются в int32.
+        typecode = "i" if max_id < 2 ** 31 else "q"
+        self.parent = array(typecode, [-1]) * (max_id + 1)
+
+    def find(self, lead_id: int) -> int:
+        parent = self.parent
+        root = lead_id
+        while parent[root] >= 0:
+            root = parent[root]
+        # Сжатие пути: все пройденные узлы сразу указывают на корень
+        while parent[lead_id] >= 0:
+            parent[lead_id], lead_id = root, parent[lead_id]
+        return root
+
+    def union(self, a: int, b: int) -> bool:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return False
+        # Корнем компоненты всегда остается самый старый лид (минимальный id)
+        if root_b < root_a:
+            root_a, root_b = root_b, root_a
+        self.parent[root_a] += self.parent[root_b]
+        self.parent[root_b] = root_a
+        return True
+
+    def component_stats(self):
+        """Число компонент из 2+ лидов и размер наибольшей - прямо по массиву"""
+        components, largest = 0, 0
+        for value in self.parent:
+            if value < -1:
+                components += 1
+                largest = max(largest, -value)
+        return components, largest
+
+
+def build_components(db: Session, chunk_size: int = 10000):
+    """Связать лидов с общими идентификаторами, читая таблицу потоком"""
+    max_id = db.query(func.max(Lead.id)).scalar()
+    if max_id is None:
+        return None
+
+    uf = LeadUnionFind(max_id)
+    for column in LINK_COLUMNS:
+        # Сортировка по индексированной колонке ставит одинаковые значения рядом,
+        # поэтому в памяти не нужен словарь идентификаторов - только предыдущая строка.
+        # Уже слитые лиды пропускаем: их обращения и так у канонического лида
+        rows = db.query(Lead.id, column).filter(
+            Lead.merged_into_id.is_(None), column.isnot(None), column != ""
+        ).order_by(column, Lead.id).yield_per(chunk_size)
+
+        prev_value, prev_id, links = None, None, 0
+        for lead_id, value in rows:
+            if value == prev_value and uf.union(prev_id, lead_id):
+                links += 1
+            prev_value, prev_id = value, lead_id
+        logger.info(f"Проход по {column.key}: объединено {links} пар лидов")
+
+    return uf
+
+
+def iter_duplicates(db: Session, uf: LeadUnionFind, chunk_size: int = 10000):
+    """Отдавать пачки пар (id дубля, id канонического лида)"""
+    # Постраничное чтение по id вместо одного курсора: между пачками
+    # вызывающий код делает commit, который закрывает открытые курсоры
+    last_id = 0
+    while True:
+        ids = [row[0] for row in db.query(Lead.id).filter(
+            Lead.id > last_id, Lead.merged_into_id.is_(None)
+        ).order_by(Lead.id).limit(chunk_size)]
+        if not ids:
+            return
+        last_id = ids[-1]
+
+        batch = [(lead_id, uf.find(lead_id)) for lead_id in ids]
+        batch = [(lead_id, root) for lead_id, root in batch if root != lead_id]
+        if batch:
+            yield batch
+
+
+def _merge_batch(db: Session, batch):
+    """Перенести обращения дублей на канонических лидов и пометить дубли слитыми"""
+    # Строка дубля остается со своими external_id/phone/email и ссылкой
+    # merged_into_id - по ним find_or_create_lead находит канонического лида.
+    # Перенос обращений - поиск по индексу lead_contacts.lead_id на каждый дубль
+    canonical_ids = {root for _, root in batch}
+    dup_ids = [dup for dup, _ in batch]
+
+    # Заполняем пустые phone/email канонического лида данными дублей,
+    # чтобы find_or_create_lead продолжал находить его по этим полям
+    canonical = {lead.id: lead for lead in db.query(Lead).filter(Lead.id.in_(canonical_ids))}
+    duplicates = {lead.id: lead for lead in db.query(Lead).filter(Lead.id.in_(dup_ids))}
+    for dup_id, root in batch:
+        lead, dup = canonical[root], duplicates[dup_id]
+        if not lead.phone and dup.phone:
+            lead.phone = dup.phone
+        if not lead.email and dup.email:
+            lead.email = dup.email
+        dup.merged_into_id = root
+
+    contacts = LeadContact.__table__
+    db.execute(
+        contacts.update()
+        .where(contacts.c.lead_id == bindparam("dup_id"))
+        .values(lead_id=bindparam("canonical_id")),
+        [{"dup_id": dup, "canonical_id": root} for dup, root in batch]
+    )
+    db.commit()
+    db.expunge_all()
+
+
+def deduplicate_leads(db: Session, chunk_size: int = 10000, dry_run: bool = False):
+    """Слить дубли лидов в канонических, фиксируя изменения пачками"""
+    report = {
+        'leads_scanned': 0,
+        'components': 0,
+        'duplicates': 0,
+        'contacts_repointed': 0,
+        'largest_component': 0,
+        'dry_run': dry_run
+    }
+
+    try:
+        logger.info(f"=== НАЧАЛО ДЕДУПЛИКАЦИИ (dry_run={dry_run}) ===")
+        report['leads_scanned'] = db.query(func.count(Lead.id)).filter(
+            Lead.merged_into_id.is_(None)
+        ).scalar()
+        uf = build_components(db, chunk_size)
+        if uf is None:
+            logger.info("Лидов нет - дедуплицировать нечего")
+            return report
+
+        report['components'], report['largest_component'] = uf.component_stats()
+
+        # Массив union-find при слиянии не меняется, поэтому отчет
+        # и само слияние считаются за один проход по пачкам
+        for batch in iter_duplicates(db, uf, chunk_size):
+            report['duplicates'] += len(batch)
+            report['contacts_repointed'] += db.query(func.count(LeadContact.id)).filter(
+                LeadContact.lead_id.in_([dup for dup, _ in batch])
+            ).scalar()
+
+            if not dry_run:
+                _merge_batch(db, batch)
+                logger.info(f"Слито дублей: {report['duplicates']}")
+
+        logger.info(f"=== ДЕДУПЛИКАЦИЯ ЗАВЕРШЕНА ===")
+        logger.info(f"Отчет: {report}")
+        return report
+
+    except Exception as e:
+        logger.error(f"Ошибка дедупликации: {str(e)}")
+        db.rollback()
+        raise
+
+
+if __name__ == "__main__":
+    from app.database import SessionLocal, init_db
+
+    parser = argparse.ArgumentParser(description="Дедупликация лидов по external_id/phone/email")
+    parser.add_argument("--dry-run", action="store_true", help="Только отчет, без изменений в БД")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="Размер пачки чтения и коммита")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    # На базе со старой схемой добавит merged_into_id и индекс lead_contacts.lead_id
+    init_db()
+    db = SessionLocal()
+    try:
+        report = deduplicate_leads(db, chunk_size=args.chunk_size, dry_run=args.dry_run)
+    finally:
+        db.close()
+
+    for key, value in report.items():
+        print(f"{key}: {value}")
@@ -6,6 +6,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 class LeadDistributor:
+    @staticmethod
+    def resolve_merged(db: Session, lead: Lead):
+        """Перейти от слитого дубля к каноническому лиду"""
+        while lead.merged_into_id is not None:
+            logger.info(f"Лид {lead.id} слит в {lead.merged_into_id}")
+            lead = db.query(Lead).filter(Lead.id == lead.merged_into_id).first()
+        return lead
+
     @staticmethod
     def find_or_create_lead(db: Session, external_id: str, phone: str = None, email: str = None):
         """Найти существующего лида или создать нового"""
@@ -17,21 +25,21 @@ class LeadDistributor:
                 lead = db.query(Lead).filter(Lead.external_id == external_id).first()
                 if lead:
                     logger.info(f"Найден существующий лид по external_id: {lead.id}")
-                    return lead
+                    return LeadDistributor.resolve_merged(db, lead)
             
             # Поиск по телефону
             if phone:
                 lead = db.query(Lead).filter(Lead.phone == phone).first()
                 if lead:
                     logger.info(f"Найден существующий лид по phone: {lead.id}")
-                    return lead
+                    return LeadDistributor.resolve_merged(db, lead)
             
             # Поиск по email
             if email:
                 lead = db.query(Lead).filter(Lead.email == email).first()
                 if lead:
                     logger.info(f"Найден существующий лид по email: {lead.id}")
-                    return lead
+                    return LeadDistributor.resolve_merged(db, lead)
             
             # Создание нового лида
             logger.info("Создание нового лида")
@@ -147,6 +155,25 @@ class LeadDistributor:
             logger.error(f"Ошибка в select_operator: {str(e)}")
             return available_operators[0]['operator'] if available_operators else None
 
+    @staticmethod
+    def warm_up(db: Session, stop=None):
+        """Прогреть маршрутизацию: выполнить запросы подбора для каждого источника
+
+        stop - threading.Event; если он выставлен, прогрев прерывается между источниками
+        """
+        # Первый вызов компилирует SQL-выражения в кэш SQLAlchemy и поднимает
+        # страницы operator_competences/lead_contacts, так что первое реальное
+        # обращение после старта воркера не платит за холодный старт
+        source_ids = [row[0] for row in db.query(Source.id).all()]
+        for source_id in source_ids:
+            if stop is not None and stop.is_set():
+                logger.info("Прогрев прерван остановкой воркера")
+                break
+            LeadDistributor.get_available_operators(db, source_id)
+        db.rollback()
+        logger.info(f"Прогрев завершен, источников: {len(source_ids)}")
+        return len(source_ids)
+
     @staticmethod
     def distribute_lead(db: Session, source_id: int, external_id: str, 
                        phone: str = None, email: str = None, message: str = ""):
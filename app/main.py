@@ -1,22 +1,102 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.database import engine, get_db, Base
+from contextlib import asynccontextmanager
+from app.database import SessionLocal, get_db, init_db
 from app import models
 from app.crud import *
 from app.distribution import LeadDistributor
+from app.sharding import ShardedDistributor
 from pydantic import BaseModel
+import asyncio
 import logging
+import os
+import threading
 import traceback
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Создаем таблицы
-models.Base.metadata.create_all(bind=engine)
+# Число процессов-шардов распределения; 0 - распределять в потоке запроса
+DISTRIBUTION_SHARDS = int(os.getenv("DISTRIBUTION_SHARDS", "0"))
+# Сколько секунд остановка воркера ждет прерванный прогрев
+WARM_UP_STOP_TIMEOUT = 10
 
-app = FastAPI(title="Lead Distribution CRM", version="1.0.0")
+router = APIRouter()
+
+def _warm_up(stop: threading.Event):
+    db = SessionLocal()
+    try:
+        LeadDistributor.warm_up(db, stop)
+    finally:
+        db.close()
+
+def _start_shards(shards: int):
+    distributor = ShardedDistributor(shards)
+    db = SessionLocal()
+    try:
+        distributor.start(db)
+    finally:
+        db.close()
+    return distributor
+
+def _run_warm_up(app: FastAPI, stop: threading.Event):
+    try:
+        _warm_up(stop)
+    except Exception as e:
+        # Прогрев - оптимизация, его ошибка не должна ронять воркер,
+        # но /health/ready показывает ее вместо обычного "ready"
+        logger.error(f"Ошибка прогрева: {str(e)}")
+        app.state.warm_up_error = str(e)
+    app.state.warm = True
+
+def _check_shard_mode(shards: int):
+    # Каждый воркер uvicorn запустил бы свои шарды над теми же операторами
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if shards and workers > 1:
+        message = f"DISTRIBUTION_SHARDS={shards} несовместим с {workers} воркерами uvicorn - запустите один воркер"
+        logger.error(message)
+        raise RuntimeError(message)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схема проверяется до приема запросов, прогрев идет в фоне -
+    # пока он не закончен, /health/ready отвечает 503
+    await asyncio.to_thread(init_db)
+    if app.state.shards:
+        _check_shard_mode(app.state.shards)
+        app.state.distributor = await asyncio.to_thread(_start_shards, app.state.shards)
+    app.state.schema_ready = True
+    stop_warm_up = threading.Event()
+    warm_up_thread = None
+    if app.state.distributor:
+        # Запросы подбора выполняют процессы-шарды, прогрев этого процесса им не поможет
+        app.state.warm = True
+    else:
+        # Отдельный daemon-поток, а не to_thread: пул потоков цикла событий
+        # дожидается своих задач при выходе, и зависший прогрев держал бы остановку
+        warm_up_thread = threading.Thread(target=_run_warm_up, args=(app, stop_warm_up), daemon=True)
+        warm_up_thread.start()
+    yield
+    if warm_up_thread:
+        # Прогрев выходит между источниками по stop_warm_up; завис на одном
+        # запросе - останавливаемся без него
+        stop_warm_up.set()
+        await asyncio.to_thread(warm_up_thread.join, WARM_UP_STOP_TIMEOUT)
+        if warm_up_thread.is_alive():
+            logger.error(f"Прогрев не завершился за {WARM_UP_STOP_TIMEOUT} с, останавливаемся без него")
+    if app.state.distributor:
+        await asyncio.to_thread(app.state.distributor.stop)
+
+def create_app(shards: int = DISTRIBUTION_SHARDS) -> FastAPI:
+    app = FastAPI(title="Lead Distribution CRM", version="1.0.0", lifespan=lifespan)
+    app.state.schema_ready = False
+    app.state.warm = False
+    app.state.warm_up_error = None
+    app.state.shards = shards
+    app.state.distributor = None
+    app.include_router(router)
+    return app
 
 # Pydantic модели для запросов и ответов
 class OperatorBase(BaseModel):
@@ -81,8 +161,14 @@ class ContactDistributionResponse(BaseModel):
     assigned_operator: Optional[OperatorContactResponse]
     status: str
 
+def _reload_shards(request: Request, db: Session):
+    # Шарды держат веса и лимиты в памяти - после изменения настроек перечитываем
+    distributor = request.app.state.distributor
+    if distributor:
+        distributor.reload(db)
+
 # Эндпоинты для операторов
-@app.post("/operators/", response_model=OperatorResponse)
+@router.post("/operators/", response_model=OperatorResponse)
 def create_operator_endpoint(operator: OperatorBase, db: Session = Depends(get_db)):
     try:
         return create_operator(db, operator.name, operator.email, operator.max_load, operator.is_active)
@@ -91,26 +177,28 @@ def create_operator_endpoint(operator: OperatorBase, db: Session = Depends(get_d
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/operators/", response_model=List[OperatorResponse])
+@router.get("/operators/", response_model=List[OperatorResponse])
 def read_operators(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return get_operators(db, skip, limit)
 
-@app.put("/operators/{operator_id}/load", response_model=OperatorResponse)
-def update_operator_load(operator_id: int, max_load: int, db: Session = Depends(get_db)):
+@router.put("/operators/{operator_id}/load", response_model=OperatorResponse)
+def update_operator_load_endpoint(operator_id: int, max_load: int, request: Request, db: Session = Depends(get_db)):
     operator = update_operator_load(db, operator_id, max_load)
     if not operator:
         raise HTTPException(status_code=404, detail="Operator not found")
+    _reload_shards(request, db)
     return operator
 
-@app.put("/operators/{operator_id}/active", response_model=OperatorResponse)
-def toggle_operator_active(operator_id: int, is_active: bool, db: Session = Depends(get_db)):
+@router.put("/operators/{operator_id}/active", response_model=OperatorResponse)
+def toggle_operator_active_endpoint(operator_id: int, is_active: bool, request: Request, db: Session = Depends(get_db)):
     operator = toggle_operator_active(db, operator_id, is_active)
     if not operator:
         raise HTTPException(status_code=404, detail="Operator not found")
+    _reload_shards(request, db)
     return operator
 
 # Эндпоинты для источников
-@app.post("/sources/", response_model=SourceResponse)
+@router.post("/sources/", response_model=SourceResponse)
 def create_source_endpoint(source: SourceBase, db: Session = Depends(get_db)):
     try:
         return create_source(db, source.name, source.description)
@@ -119,28 +207,42 @@ def create_source_endpoint(source: SourceBase, db: Session = Depends(get_db)):
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/sources/", response_model=List[SourceResponse])
+@router.get("/sources/", response_model=List[SourceResponse])
 def read_sources(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return get_sources(db, skip, limit)
 
 # Эндпоинты для настройки распределения
-@app.post("/competences/", response_model=CompetenceResponse)
-def set_competence(competence: CompetenceSet, db: Session = Depends(get_db)):
+@router.post("/competences/", response_model=CompetenceResponse)
+def set_competence(competence: CompetenceSet, request: Request, db: Session = Depends(get_db)):
     try:
-        return set_operator_competence(db, competence.operator_id, competence.source_id, competence.weight)
+        result = set_operator_competence(db, competence.operator_id, competence.source_id, competence.weight)
+        _reload_shards(request, db)
+        return result
     except Exception as e:
         logger.error(f"Error setting competence: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/sources/{source_id}/competences/")
+@router.get("/sources/{source_id}/competences/")
 def get_source_competences_endpoint(source_id: int, db: Session = Depends(get_db)):
     return get_source_competences(db, source_id)
 
 # Основной эндпоинт для регистрации обращения
-@app.post("/contacts/", response_model=ContactDistributionResponse)
-def create_contact(contact: ContactCreate, db: Session = Depends(get_db)):
+@router.post("/contacts/", response_model=ContactDistributionResponse)
+def create_contact(contact: ContactCreate, request: Request, db: Session = Depends(get_db)):
     try:
+        distributor = request.app.state.distributor
+        if distributor:
+            # Шард возвращает словари - ORM-объекты между процессами не передаются
+            contact_data, operator_data = distributor.distribute(
+                contact.source_id, contact.external_id, contact.phone, contact.email, contact.message
+            )
+            return ContactDistributionResponse(
+                contact=ContactResponse(**contact_data),
+                assigned_operator=OperatorContactResponse(**operator_data) if operator_data else None,
+                status="assigned" if operator_data else "no_operator_available"
+            )
+
         result_contact, operator = LeadDistributor.distribute_lead(
             db, contact.source_id, contact.external_id, contact.phone, contact.email, contact.message
         )
@@ -175,7 +277,7 @@ def create_contact(contact: ContactCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 # Эндпоинты для просмотра состояния
-@app.get("/leads/")
+@router.get("/leads/")
 def read_leads(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     leads = get_leads_with_contacts(db, skip, limit)
     # Упрощаем ответ для избежания проблем с сериализацией
@@ -203,7 +305,7 @@ def read_leads(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     
     return simplified_leads
 
-@app.get("/operators/{operator_id}/stats/")
+@router.get("/operators/{operator_id}/stats/")
 def get_operator_stats_endpoint(operator_id: int, db: Session = Depends(get_db)):
     stats = get_operator_stats(db, operator_id)
     if not stats:
@@ -223,10 +325,34 @@ def get_operator_stats_endpoint(operator_id: int, db: Session = Depends(get_db))
         "load_percentage": stats['load_percentage']
     }
 
-@app.get("/")
+@router.get("/")
 def read_root():
     return {"message": "Lead Distribution CRM API"}
 
+# Эндпоинты для оркестратора
+@router.get("/health/live")
+def liveness():
+    return {"status": "alive"}
+
+@router.get("/health/ready")
+def readiness(request: Request):
+    state = request.app.state
+    body = {"schema_ready": state.schema_ready, "warm": state.warm, "warm_up_error": state.warm_up_error}
+    if not (state.schema_ready and state.warm):
+        return JSONResponse(status_code=503, content={"status": "starting", **body})
+    degraded = bool(state.warm_up_error)
+    if state.distributor:
+        # Не 503: умерший шард перезапускается при следующем обращении к его
+        # источникам, и снятый с балансировщика воркер не восстановился бы
+        body["shards"] = state.distributor.shards
+        body["shards_alive"] = state.distributor.alive_shards()
+        degraded = degraded or body["shards_alive"] < body["shards"]
+    # Без прогрева воркер обслуживает запросы, только первые будут медленнее
+    return {"status": "degraded" if degraded else "ready", **body}
+
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
+    logging.basicConfig(level=logging.INFO)
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
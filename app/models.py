@@ -1,7 +1,7 @@
 from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
-from database import Base
+from app.database import Base
 
 class Operator(Base):
     __tablename__ = "operators"
@@ -24,6 +24,8 @@ class Lead(Base):
     phone = Column(String, index=True, nullable=True)
     email = Column(String, index=True, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Заполняется дедупликацией: лид слит в указанного канонического лида
+    merged_into_id = Column(Integer, ForeignKey("leads.id"), nullable=True, index=True)
     
     # Исправляем отношения
     contacts = relationship("LeadContact", back_populates="lead", cascade="all, delete-orphan")
@@ -54,7 +56,7 @@ class LeadContact(Base):
     __tablename__ = "lead_contacts"
     
     id = Column(Integer, primary_key=True, index=True)
-    lead_id = Column(Integer, ForeignKey("leads.id"))
+    lead_id = Column(Integer, ForeignKey("leads.id"), index=True)
     source_id = Column(Integer, ForeignKey("sources.id"))
     operator_id = Column(Integer, ForeignKey("operators.id"), nullable=True)
     message = Column(String)
@@ -0,0 +1,388 @@
+import itertools
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+import multiprocessing
+from multiprocessing.connection import wait
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models import Operator, OperatorCompetence, LeadContact, Source
+from app.distribution import LeadDistributor
+
+try:
+    import fcntl
+except ImportError:  # Windows - проверки единственного владельца шардов нет
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Как часто шард перечитывает нагрузку операторов из lead_contacts, в секундах.
+# Между синхронизациями шард видит свои новые назначения сразу, а закрытие
+# обращений - с задержкой до интервала: нагрузка может быть только завышена
+LOAD_SYNC_INTERVAL = float(os.getenv("LOAD_SYNC_INTERVAL", "5"))
+# Как часто сборщик ответов проверяет, живы ли процессы-шарды, в секундах
+SHARD_CHECK_INTERVAL = 1.0
+SHARD_LOCK_PATH = os.getenv(
+    "SHARD_LOCK_PATH", os.path.join(tempfile.gettempdir(), "lead_crm_shards.lock")
+)
+
+# Легкая замена ORM-объекта оператора: select_operator нужен только .id
+OperatorRef = namedtuple("OperatorRef", ["id", "name", "email", "max_load"])
+
+
+def plan_shards(db: Session, shards: int):
+    """Разложить источники по шардам: {source_id: номер шарда}"""
+    # Источники с общими операторами должны жить в одном процессе, иначе
+    # нагрузку оператора пришлось бы синхронизировать между процессами.
+    # Поэтому раскладываем компоненты связности графа источник-оператор.
+    parent = {source_id: source_id for (source_id,) in db.query(Source.id)}
+
+    def find(source_id):
+        while parent[source_id] != source_id:
+            parent[source_id] = parent[parent[source_id]]
+            source_id = parent[source_id]
+        return source_id
+
+    first_source = {}
+    for operator_id, source_id in db.query(OperatorCompetence.operator_id, OperatorCompetence.source_id):
+        if source_id not in parent:
+            continue
+        if operator_id in first_source:
+            root_a, root_b = find(first_source[operator_id]), find(source_id)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+        else:
+            first_source[operator_id] = source_id
+
+    components = {}
+    for source_id in parent:
+        components.setdefault(find(source_id), []).append(source_id)
+
+    # Жадно: крупные компоненты первыми в наименее заполненный шард
+    sizes = [0] * shards
+    placement = {}
+    for sources in sorted(components.values(), key=len, reverse=True):
+        shard = sizes.index(min(sizes))
+        sizes[shard] += len(sources)
+        for source_id in sources:
+            placement[source_id] = shard
+    return placement
+
+
+class ShardState:
+    """Маршрутизация и нагрузка операторов для источников одного шарда"""
+
+    def __init__(self):
+        self.routes = {}
+        self.operators = {}
+        self.load = {}
+
+    def assign(self, db: Session, source_ids):
+        """Загрузить компетенции и текущую нагрузку для своих источников"""
+        rows = db.query(
+            OperatorCompetence.source_id, OperatorCompetence.weight,
+            Operator.id, Operator.name, Operator.email, Operator.max_load
+        ).join(Operator, Operator.id == OperatorCompetence.operator_id).filter(
+            OperatorCompetence.source_id.in_(source_ids),
+            Operator.is_active.is_(True)
+        ).order_by(OperatorCompetence.id)
+
+        self.routes, self.operators = {}, {}
+        for source_id, weight, operator_id, name, email, max_load in rows:
+            self.operators[operator_id] = OperatorRef(operator_id, name, email, max_load)
+            self.routes.setdefault(source_id, []).append((operator_id, weight))
+
+        self.sync_load(db)
+        logger.info(f"Шард принял источников: {len(source_ids)}, операторов: {len(self.operators)}")
+
+    def sync_load(self, db: Session):
+        """Перечитать текущую нагрузку своих операторов одним запросом"""
+        load = dict.fromkeys(self.operators, 0)
+        if self.operators:
+            load.update(db.query(LeadContact.operator_id, func.count(LeadContact.id)).filter(
+                LeadContact.operator_id.in_(list(self.operators)),
+                LeadContact.status.in_(["new", "in_progress"])
+            ).group_by(LeadContact.operator_id).all())
+        db.rollback()
+        self.load = load
+
+    def distribute(self, db: Session, source_id: int, external_id: str,
+                   phone: str = None, email: str = None, message: str = ""):
+        """То же, что LeadDistributor.distribute_lead, но без запросов нагрузки"""
+        lead = LeadDistributor.find_or_create_lead(db, external_id, phone, email)
+
+        available_operators = []
+        for operator_id, weight in self.routes.get(source_id, []):
+            operator = self.operators[operator_id]
+            if self.load[operator_id] < operator.max_load:
+                available_operators.append({
+                    'operator': operator,
+                    'weight': weight,
+                    'current_load': self.load[operator_id]
+                })
+        selected_operator = LeadDistributor.select_operator(available_operators)
+
+        contact = LeadContact(
+            lead_id=lead.id,
+            source_id=source_id,
+            operator_id=selected_operator.id if selected_operator else None,
+            message=message,
+            status="new" if selected_operator else "no_operator"
+        )
+        db.add(contact)
+        db.commit()
+        if selected_operator:
+            self.load[selected_operator.id] += 1
+
+        contact_data = {
+            'id': contact.id,
+            'lead_id': contact.lead_id,
+            'source_id': contact.source_id,
+            'operator_id': contact.operator_id,
+            'message': contact.message,
+            'status': contact.status
+        }
+        db.expunge_all()
+        operator_data = selected_operator._asdict() if selected_operator else None
+        return contact_data, operator_data
+
+
+def _shard_main(inbox, results, sync_interval):
+    """Цикл процесса-шарда: команды приходят по очереди, ответы уходят в свой канал"""
+    from app.database import SessionLocal
+
+    state = ShardState()
+    db = SessionLocal()
+    synced_at = time.monotonic()
+    try:
+        while True:
+            # Нагрузка пересинхронизируется и под потоком обращений, и в простое
+            if time.monotonic() - synced_at >= sync_interval:
+                try:
+                    state.sync_load(db)
+                except Exception as e:
+                    # Остаемся на прежней нагрузке и пробуем на следующем интервале
+                    logger.error(f"Ошибка синхронизации нагрузки: {str(e)}")
+                    db.rollback()
+                synced_at = time.monotonic()
+            try:
+                message = inbox.get(timeout=sync_interval)
+            except queue.Empty:
+                continue
+            if message is None:
+                break
+            kind, request_id, payload = message
+            try:
+                if kind in ("assign", "sync"):
+                    if kind == "assign":
+                        state.assign(db, payload)
+                    else:
+                        state.sync_load(db)
+                    synced_at = time.monotonic()
+                    results.send((request_id, True, None))
+                else:
+                    results.send((request_id, True, state.distribute(db, **payload)))
+            except Exception as e:
+                logger.error(f"Ошибка в шарде: {str(e)}")
+                db.rollback()
+                results.send((request_id, False, str(e)))
+    finally:
+        db.close()
+
+
+class ShardedDistributor:
+    """Распределение обращений в процессах, каждый из которых владеет своими источниками"""
+
+    def __init__(self, shards: int, sync_interval: float = LOAD_SYNC_INTERVAL,
+                 lock_path: str = SHARD_LOCK_PATH):
+        self.shards = shards
+        self.sync_interval = sync_interval
+        self.lock_path = lock_path
+        self._lock_file = None
+        self.placement = {}
+        self._context = multiprocessing.get_context("spawn")
+        self._inboxes = []
+        self._processes = []
+        # Канал ответов у каждого шарда свой: общая очередь держит межпроцессную
+        # блокировку записи, и шард, убитый посреди записи, останавливал бы все остальные
+        self._outboxes = []
+        self._stopping = threading.Event()
+        # request_id -> (номер шарда, Future); шард нужен, чтобы быстро
+        # завершить ожидания, если его процесс умер
+        self._futures = {}
+        self._futures_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = None
+
+    def _acquire_owner_lock(self):
+        # Два набора шардов на одной БД владели бы одними и теми же операторами,
+        # и max_load превышался бы кратно - второй владелец не запускается
+        if fcntl is None:
+            return
+        self._lock_file = open(self.lock_path, "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError(
+                f"Шарды распределения уже запущены другим процессом ({self.lock_path}): "
+                f"DISTRIBUTION_SHARDS требует одного воркера uvicorn"
+            )
+
+    def _spawn(self):
+        inbox = self._context.Queue()
+        outbox, results = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_shard_main, args=(inbox, results, self.sync_interval), daemon=True
+        )
+        process.start()
+        # Пишущий конец остается только у шарда - его смерть видна как EOF
+        results.close()
+        return inbox, outbox, process
+
+    def start(self, db: Session):
+        self._acquire_owner_lock()
+        self._stopping.clear()
+        for _ in range(self.shards):
+            inbox, outbox, process = self._spawn()
+            self._inboxes.append(inbox)
+            self._outboxes.append(outbox)
+            self._processes.append(process)
+
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        self.reload(db)
+        logger.info(f"Запущено шардов распределения: {self.shards}")
+
+    def _collect(self):
+        checked_at = time.monotonic()
+        while not self._stopping.is_set():
+            outboxes = [outbox for outbox in self._outboxes if not outbox.closed]
+            for outbox in wait(outboxes, timeout=SHARD_CHECK_INTERVAL):
+                try:
+                    self._resolve(*outbox.recv())
+                except (EOFError, OSError):
+                    # Процесс шарда завершился; ожидания снимет _fail_dead_shards
+                    outbox.close()
+            if time.monotonic() - checked_at >= SHARD_CHECK_INTERVAL:
+                self._fail_dead_shards()
+                checked_at = time.monotonic()
+
+    def _resolve(self, request_id, ok, payload):
+        with self._futures_lock:
+            entry = self._futures.pop(request_id, None)
+        if entry is None:
+            # Ожидание уже завершено ошибкой при падении шарда
+            return
+        if ok:
+            entry[1].set_result(payload)
+        else:
+            entry[1].set_exception(RuntimeError(payload))
+
+    def _fail_dead_shards(self):
+        """Сразу вернуть ошибку всем, кто ждет ответа от умершего процесса"""
+        dead = {shard for shard, process in enumerate(self._processes) if not process.is_alive()}
+        if not dead:
+            return
+        with self._futures_lock:
+            failed = [(request_id, entry) for request_id, entry in self._futures.items() if entry[0] in dead]
+            for request_id, _ in failed:
+                del self._futures[request_id]
+        for _, (shard, future) in failed:
+            future.set_exception(RuntimeError(f"Процесс шарда {shard} завершился"))
+
+    def _ensure_alive(self, shard: int, timeout: float):
+        """Перезапустить умерший шард и отдать ему его источники (под self._lock)"""
+        if self._processes[shard].is_alive():
+            return
+        logger.error(f"Шард {shard} завершился с кодом {self._processes[shard].exitcode}, перезапуск")
+        self._fail_dead_shards()
+        self._inboxes[shard], self._outboxes[shard], self._processes[shard] = self._spawn()
+        sources = [source_id for source_id, owner in self.placement.items() if owner == shard]
+        self._submit(shard, "assign", sources).result(timeout)
+
+    def _submit(self, shard: int, kind: str, payload):
+        request_id = next(self._ids)
+        future = Future()
+        with self._futures_lock:
+            self._futures[request_id] = (shard, future)
+        self._inboxes[shard].put((kind, request_id, payload))
+        return future
+
+    def alive_shards(self):
+        """Число живых процессов-шардов - для /health/ready"""
+        return sum(process.is_alive() for process in self._processes)
+
+    def reload(self, db: Session, timeout: float = 30):
+        """Пересчитать раскладку источников и перечитать состояние шардов"""
+        # Под блокировкой новые обращения ждут, пока все шарды не примут
+        # новую раскладку - иначе один источник мог бы жить в двух процессах
+        with self._lock:
+            for shard in range(self.shards):
+                self._ensure_alive(shard, timeout)
+            self.placement = plan_shards(db, self.shards)
+            assigned = [[] for _ in range(self.shards)]
+            for source_id, shard in self.placement.items():
+                assigned[shard].append(source_id)
+            futures = [self._submit(shard, "assign", sources) for shard, sources in enumerate(assigned)]
+            for future in futures:
+                future.result(timeout)
+
+    def sync_load(self, timeout: float = 30):
+        """Немедленно перечитать нагрузку во всех шардах (хук для смены статусов)"""
+        with self._lock:
+            for shard in range(self.shards):
+                self._ensure_alive(shard, timeout)
+            futures = [self._submit(shard, "sync", None) for shard in range(self.shards)]
+        for future in futures:
+            future.result(timeout)
+
+    def distribute(self, source_id: int, external_id: str, phone: str = None,
+                   email: str = None, message: str = "", timeout: float = 30):
+        """Передать обращение шарду источника и дождаться результата"""
+        with self._lock:
+            # Неизвестный источник: операторов у него нет, шард создаст обращение без оператора
+            shard = self.placement.get(source_id, source_id % self.shards)
+            self._ensure_alive(shard, timeout)
+            future = self._submit(shard, "contact", {
+                'source_id': source_id,
+                'external_id': external_id,
+                'phone': phone,
+                'email': email,
+                'message': message
+            })
+        return future.result(timeout)
+
+    def stop(self, timeout: float = 5):
+        for inbox in self._inboxes:
+            # Очередь зависшего шарда не должна держать выход интерпретатора
+            inbox.cancel_join_thread()
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                # Шард завис на запросе к БД - не держим остановку приложения
+                logger.error(f"Шард {process.pid} не остановился за {timeout} с, завершаем принудительно")
+                process.terminate()
+                process.join(timeout)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+        self._stopping.set()
+        if self._collector is not None:
+            self._collector.join()
+            self._collector = None
+        for outbox in self._outboxes:
+            outbox.close()
+        self._inboxes, self._outboxes, self._processes = [], [], []
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
@@ -0,0 +1,88 @@
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# БД бенчмарка задается до импорта приложения; для реальной картины
+# масштабирования лучше PostgreSQL - SQLite сериализует запись всех процессов
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_sharding.db')}"
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.database import SessionLocal, init_db
+from app.crud import create_operator, create_source, set_operator_competence
+from app.distribution import LeadDistributor
+from app.sharding import ShardedDistributor
+
+SHARD_COUNTS = [1, 2, 4, 8]
+SOURCES = 8
+OPERATORS_PER_SOURCE = 4
+CONTACTS = 2000
+CLIENT_THREADS = 8
+
+
+def setup_data():
+    """Источники с непересекающимися пулами операторов - по компоненте на источник"""
+    db = SessionLocal()
+    try:
+        source_ids = []
+        for s in range(SOURCES):
+            source = create_source(db, f"bench_source_{s}_{time.time_ns()}")
+            source_ids.append(source.id)
+            for o in range(OPERATORS_PER_SOURCE):
+                operator = create_operator(db, f"bench_op_{s}_{o}", f"op_{s}_{o}_{time.time_ns()}@bench",
+                                           max_load=10 ** 9)
+                set_operator_competence(db, operator.id, source.id, weight=o + 1)
+        return source_ids
+    finally:
+        db.close()
+
+
+def run_round(label, distribute, source_ids):
+    """Отправить CONTACTS обращений из пула клиентских потоков, вернуть обращений/с"""
+    def send(i):
+        distribute(source_ids[i % len(source_ids)], f"{label}_{i}", f"+7{label}{i}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(CLIENT_THREADS) as pool:
+        list(pool.map(send, range(CONTACTS)))
+    return CONTACTS / (time.perf_counter() - started)
+
+
+def in_process(source_id, external_id, phone):
+    db = SessionLocal()
+    try:
+        LeadDistributor.distribute_lead(db, source_id, external_id, phone)
+    finally:
+        db.close()
+
+
+def bench_sharding():
+    print("=== БЕНЧМАРК ШАРДИРОВАННОГО РАСПРЕДЕЛЕНИЯ ===\n")
+    print(f"БД: {os.environ['DATABASE_URL']}, ядер: {os.cpu_count()}")
+    print(f"Обращений за раунд: {CONTACTS}, клиентских потоков: {CLIENT_THREADS}\n")
+
+    init_db()
+    source_ids = setup_data()
+
+    baseline = run_round("inproc", in_process, source_ids)
+    print(f"{'режим':<16}{'обращений/с':>14}{'ускорение':>12}")
+    print(f"{'в потоке':<16}{baseline:>14.1f}{1.0:>12.2f}")
+
+    for shards in SHARD_COUNTS:
+        distributor = ShardedDistributor(shards)
+        db = SessionLocal()
+        try:
+            distributor.start(db)
+        finally:
+            db.close()
+        try:
+            throughput = run_round(f"s{shards}", distributor.distribute, source_ids)
+        finally:
+            distributor.stop()
+        print(f"{f'шардов: {shards}':<16}{throughput:>14.1f}{throughput / baseline:>12.2f}")
+
+
+if __name__ == "__main__":
+    bench_sharding()
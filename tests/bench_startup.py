@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+
+WORKER_COUNTS = [1, 2, 4, 8]
+
+
+def boot_worker():
+    """Один воркер: импорт приложения, lifespan до полной готовности"""
+    import asyncio
+
+    started = time.perf_counter()
+    from app.main import create_app
+    imported = time.perf_counter()
+
+    async def run():
+        app = create_app()
+        async with app.router.lifespan_context(app):
+            schema_ready = time.perf_counter()
+            while not app.state.warm:
+                await asyncio.sleep(0.001)
+            return schema_ready
+
+    schema_ready = asyncio.run(run())
+    warm = time.perf_counter()
+    print(json.dumps({
+        'import': imported - started,
+        'schema': schema_ready - started,
+        'ready': warm - started
+    }))
+
+
+def boot_workers(count, db_path):
+    """Запустить count воркеров одновременно, как uvicorn --workers"""
+    env = dict(os.environ,
+               DATABASE_URL=f"sqlite:///{db_path}",
+               SCHEMA_LOCK_PATH=db_path + ".lock",
+               PYTHONPATH=ROOT)
+    started = time.perf_counter()
+    processes = [
+        subprocess.Popen([sys.executable, __file__, "--worker"], env=env,
+                         stdout=subprocess.PIPE, text=True)
+        for _ in range(count)
+    ]
+    results = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in processes]
+    total = time.perf_counter() - started
+    return total, results
+
+
+def bench_startup():
+    print("=== БЕНЧМАРК СТАРТА ВОРКЕРОВ ===\n")
+    print(f"{'режим':<8}{'воркеры':>8}{'всего, с':>10}{'импорт':>10}{'схема':>10}{'готов':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in WORKER_COUNTS:
+            db_path = os.path.join(tmp, f"bench_{count}.db")
+            # cold - пустая БД, схему создает первый воркер;
+            # warm - повторный старт поверх готовой схемы (rolling restart)
+            for mode in ("cold", "warm"):
+                total, results = boot_workers(count, db_path)
+                worst = {key: max(r[key] for r in results) for key in results[0]}
+                print(f"{mode:<8}{count:>8}{total:>10.3f}"
+                      f"{worst['import']:>10.3f}{worst['schema']:>10.3f}{worst['ready']:>10.3f}")
+
+    print("\nВремена импорта/схемы/готовности - максимум по воркерам, от старта процесса")
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        boot_worker()
+    else:
+        bench_startup()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.models import Base
+
+
+@pytest.fixture
+def make_session():
+    """Фабрика сессий к БД со свежей схемой; по умолчанию SQLite в памяти"""
+    sessions = []
+
+    def make(url="sqlite://"):
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        sessions.append(session)
+        return session
+
+    yield make
+    for session in sessions:
+        session.close()
+
+
+@pytest.fixture
+def db(make_session):
+    return make_session()
@@ -0,0 +1,123 @@
+import os
+import random
+import sys
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.models import Lead, LeadContact, Operator, OperatorCompetence, Source
+from app.analysis import (Config, NOT_COMPETENT, fairness_report, load_config, load_history,
+                          simulate, source_mix, with_changes)
+from app.distribution import LeadDistributor
+
+RUNS = 20000
+TOLERANCE = 0.02
+
+
+def single_source_config(weights, max_load, order=None):
+    """Один источник, операторы с id 1..n; order - порядок строк компетенций"""
+    n = len(weights)
+    order = list(range(n)) if order is None else order
+    return Config(
+        source_ids=np.array([1]),
+        operator_ids=np.arange(1, n + 1),
+        weights=np.array([weights], dtype=float),
+        competent=np.ones((1, n), dtype=bool),
+        max_load=np.array(max_load),
+        active=np.ones(n, dtype=bool),
+        order=np.array([order], dtype=np.int64)
+    )
+
+
+def select_operator_shares(available):
+    """Доли, которые дает настоящий select_operator на списке (operator_id, weight)"""
+    random.seed(0)
+    operators = [{'operator': SimpleNamespace(id=op), 'weight': w} for op, w in available]
+    counts = Counter(LeadDistributor.select_operator(operators).id for _ in range(RUNS))
+    return {op: counts[op] / RUNS for op, _ in available}
+
+
+def simulated_shares(config, initial_load):
+    result = simulate(config, initial_load, [1.0], contacts=1, runs=RUNS, seed=0)
+    return {int(op): result['assigned_share'][o] for o, op in enumerate(config.operator_ids)}
+
+
+def assert_shares_match(simulated, real):
+    for op, share in real.items():
+        assert simulated[op] == pytest.approx(share, abs=TOLERANCE)
+    assert sum(simulated.values()) == pytest.approx(sum(real.values()), abs=TOLERANCE)
+
+
+def test_weighted_shares_match_select_operator():
+    config = single_source_config([10, 30], [100, 100])
+    real = select_operator_shares([(1, 10), (2, 30)])
+    assert real[2] == pytest.approx(0.75, abs=TOLERANCE)
+    assert_shares_match(simulated_shares(config, [0, 0]), real)
+
+
+def test_zero_weights_pick_first_competence_row():
+    # Строка компетенции оператора 2 создана раньше, чем у оператора 1
+    config = single_source_config([0, 0], [100, 100], order=[1, 0])
+    real = select_operator_shares([(2, 0), (1, 0)])
+    assert real == {2: 1.0, 1: 0.0}
+    assert_shares_match(simulated_shares(config, [0, 0]), real)
+
+
+def test_saturated_operator_is_excluded():
+    config = single_source_config([10, 30, 60], [100, 100, 5])
+    # get_available_operators не передал бы оператора 3 с нагрузкой 5 из 5
+    real = select_operator_shares([(1, 10), (2, 30)])
+    simulated = simulated_shares(config, [0, 0, 5])
+    assert simulated[3] == 0
+    assert_shares_match(simulated, real)
+
+
+def test_completion_frees_load():
+    config = single_source_config([1], [1])
+    filling = simulate(config, [0], [1.0], contacts=10, runs=100, seed=0)
+    assert filling['unassigned_rate'] == pytest.approx(0.9)
+    steady = simulate(config, [0], [1.0], contacts=10, runs=100, seed=0, completion_rate=1.0)
+    assert steady['unassigned_rate'] == 0
+
+
+def test_with_changes_appends_new_competence():
+    config = single_source_config([1, 0], [10, 10], order=[0, NOT_COMPETENT])
+    config = config._replace(competent=np.array([[True, False]]))
+    changed = with_changes(config, max_load={2: 3}, weights={(2, 1): 5})
+    assert changed.competent[0, 1] and changed.weights[0, 1] == 5
+    assert changed.order[0, 1] == 1
+    assert changed.max_load[1] == 3
+    assert config.max_load[1] == 10
+
+
+def test_load_config_and_fairness_report(db):
+    db.add(Source(name="s"))
+    db.add_all([Operator(name="o1", email="o1", max_load=4), Operator(name="o2", email="o2", max_load=4)])
+    db.add_all([OperatorCompetence(operator_id=2, source_id=1, weight=30),
+                OperatorCompetence(operator_id=1, source_id=1, weight=10)])
+    db.add(Lead(external_id="l"))
+    db.commit()
+    statuses = [(1, "new"), (2, "new"), (2, "new"), (2, "closed")]
+    db.add_all([LeadContact(lead_id=1, source_id=1, operator_id=op, status=st) for op, st in statuses])
+    db.commit()
+
+    config = load_config(db)
+    assert config.order[0].tolist() == [1, 0]
+    history = load_history(db, config, chunk_size=3)
+    report, utilization = fairness_report(config, history)
+
+    assert report[0]['contacts'] == 4
+    assert report[0]['chi2'] == pytest.approx(0.0)
+    assert report[0]['operators'][2]['observed_share'] == pytest.approx(0.75)
+    assert utilization == {1: 0.25, 2: 0.5}
+
+
+def test_empty_db(db):
+    config = load_config(db)
+    history = load_history(db, config)
+    assert len(source_mix(config, history)) == 0
+    with pytest.raises(ValueError):
+        simulate(config, [], [], contacts=1, runs=1)
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app import database
+from app.models import Base
+
+
+@pytest.fixture
+def fresh_init(tmp_path, monkeypatch):
+    """init_db на отдельном движке, как будто процесс только что стартовал"""
+    monkeypatch.setattr(database, "SCHEMA_LOCK_PATH", str(tmp_path / "schema.lock"))
+    monkeypatch.setattr(database, "_schema_ready", False)
+    return create_engine(f"sqlite:///{tmp_path / 'crm.db'}")
+
+
+def test_init_db_upgrades_baseline_schema(fresh_init):
+    # Схема до дедупликации: нет leads.merged_into_id и индекса lead_contacts.lead_id
+    with fresh_init.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE leads (id INTEGER PRIMARY KEY, external_id VARCHAR UNIQUE, "
+            "phone VARCHAR, email VARCHAR, created_at DATETIME)"
+        ))
+        connection.execute(text(
+            "CREATE TABLE lead_contacts (id INTEGER PRIMARY KEY, lead_id INTEGER, source_id INTEGER, "
+            "operator_id INTEGER, message VARCHAR, status VARCHAR, created_at DATETIME)"
+        ))
+        connection.execute(text("INSERT INTO leads (id, external_id) VALUES (1, 'old')"))
+
+    assert database.init_db(fresh_init) is True
+
+    inspector = inspect(fresh_init)
+    assert set(inspector.get_table_names()) == set(Base.metadata.tables)
+    assert "merged_into_id" in {column['name'] for column in inspector.get_columns("leads")}
+    assert "ix_lead_contacts_lead_id" in {index['name'] for index in inspector.get_indexes("lead_contacts")}
+    with fresh_init.connect() as connection:
+        assert connection.execute(text("SELECT external_id, merged_into_id FROM leads")).all() == [("old", None)]
+
+
+def test_init_db_creates_all_tables_once(fresh_init):
+    assert database.init_db(fresh_init) is True
+    assert set(inspect(fresh_init).get_table_names()) == set(Base.metadata.tables)
+    # Повторный вызов в том же процессе не трогает схему
+    assert database.init_db(fresh_init) is False
+
+
+def test_init_db_on_current_schema_changes_nothing(fresh_init):
+    Base.metadata.create_all(fresh_init)
+    assert database.init_db(fresh_init) is False
@@ -0,0 +1,99 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.models import Lead, LeadContact, Source
+from app.dedup import deduplicate_leads
+from app.distribution import LeadDistributor
+
+
+def add_leads(db, rows):
+    """Создать лидов (external_id, phone, email) и по одному обращению на каждого"""
+    db.add(Source(name="source"))
+    leads = [Lead(external_id=ext, phone=phone, email=email) for ext, phone, email in rows]
+    db.add_all(leads)
+    db.commit()
+    for lead in leads:
+        db.add(LeadContact(lead_id=lead.id, source_id=1, message=lead.external_id))
+    db.commit()
+    return [lead.id for lead in leads]
+
+
+def snapshot(db):
+    db.expire_all()
+    leads = [(l.id, l.external_id, l.phone, l.email, l.merged_into_id) for l in db.query(Lead).order_by(Lead.id)]
+    contacts = [(c.id, c.lead_id) for c in db.query(LeadContact).order_by(LeadContact.id)]
+    return leads, contacts
+
+
+# a-b связаны телефоном, b-c почтой: a, b, c - один человек.
+# d и f связаны только пустой строкой телефона - это не связь.
+ROWS = [
+    ("a", "+7001", None),
+    ("b", "+7001", "x@test"),
+    ("c", None, "x@test"),
+    ("d", "", "d@test"),
+    ("e", "+7002", None),
+    ("f", "", "f@test"),
+    ("g", "+7002", ""),
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 100])
+def test_transitive_components_merged_into_oldest(db, chunk_size):
+    ids = add_leads(db, ROWS)
+    report = deduplicate_leads(db, chunk_size=chunk_size)
+
+    assert report['duplicates'] == 3
+    assert report['components'] == 2
+    assert report['largest_component'] == 3
+    assert report['contacts_repointed'] == 3
+
+    leads, contacts = snapshot(db)
+    merged = {lead_id: into for lead_id, _, _, _, into in leads}
+    a, b, c, d, e, f, g = ids
+    assert merged == {a: None, b: a, c: a, d: None, e: None, f: None, g: e}
+    assert [lead_id for _, lead_id in contacts] == [a, a, a, d, e, f, e]
+
+
+def test_canonical_lead_gets_missing_identifiers(db):
+    add_leads(db, ROWS)
+    deduplicate_leads(db)
+    canonical = db.query(Lead).filter(Lead.external_id == "a").one()
+    assert (canonical.phone, canonical.email) == ("+7001", "x@test")
+
+
+def test_dry_run_leaves_db_unchanged(db):
+    add_leads(db, ROWS)
+    before = snapshot(db)
+    report = deduplicate_leads(db, chunk_size=2, dry_run=True)
+    assert report['duplicates'] == 3
+    assert snapshot(db) == before
+
+
+def test_second_run_is_noop(db):
+    add_leads(db, ROWS)
+    deduplicate_leads(db, chunk_size=2)
+    after_first = snapshot(db)
+    report = deduplicate_leads(db, chunk_size=2)
+    assert report['duplicates'] == 0
+    assert report['components'] == 0
+    assert report['leads_scanned'] == 4
+    assert snapshot(db) == after_first
+
+
+def test_merged_identifiers_resolve_to_canonical_lead(db):
+    ids = add_leads(db, ROWS)
+    deduplicate_leads(db)
+    a = ids[0]
+    assert LeadDistributor.find_or_create_lead(db, "c").id == a
+    assert LeadDistributor.find_or_create_lead(db, "new", email="x@test").id == a
+    assert db.query(Lead).filter(Lead.external_id == "new").count() == 0
+
+
+def test_empty_table(db):
+    report = deduplicate_leads(db)
+    assert report['leads_scanned'] == 0
+    assert report['duplicates'] == 0
@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app import main
+
+
+class FakeDistributor:
+    def __init__(self, shards, alive):
+        self.shards = shards
+        self.alive = alive
+        self.stopped = False
+
+    def alive_shards(self):
+        return self.alive
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """Приложение без обращений к настоящей БД: схему проверяет test_database"""
+    monkeypatch.setattr(main, "init_db", lambda: True)
+    return main.create_app(shards=0)
+
+
+def wait_ready(client, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get("/health/ready")
+        if response.status_code == 200:
+            return response
+        time.sleep(0.01)
+    raise AssertionError("воркер не стал готов")
+
+
+def test_ready_only_after_warm_up(app, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(main, "_warm_up", lambda stop: release.wait(5))
+    with TestClient(app) as client:
+        response = client.get("/health/ready")
+        assert response.status_code == 503
+        assert response.json()['status'] == "starting"
+        assert client.get("/health/live").json() == {"status": "alive"}
+        release.set()
+        assert wait_ready(client).json()['status'] == "ready"
+
+
+def test_failed_warm_up_is_degraded(app, monkeypatch):
+    def failing(stop):
+        raise RuntimeError("БД недоступна")
+
+    monkeypatch.setattr(main, "_warm_up", failing)
+    with TestClient(app) as client:
+        body = wait_ready(client).json()
+        assert body['status'] == "degraded"
+        assert body['warm_up_error'] == "БД недоступна"
+
+
+def test_live_answers_before_startup(app):
+    # Без lifespan схема не проверена и прогрева не было
+    client = TestClient(app)
+    assert client.get("/health/live").status_code == 200
+    assert client.get("/health/ready").status_code == 503
+
+
+def test_shutdown_does_not_wait_for_stuck_warm_up(app, monkeypatch):
+    release = threading.Event()
+    # Прогрев завис на одном запросе и не проверяет stop
+    monkeypatch.setattr(main, "_warm_up", lambda stop: release.wait(10))
+    monkeypatch.setattr(main, "WARM_UP_STOP_TIMEOUT", 0.2)
+    try:
+        started = time.monotonic()
+        with TestClient(app):
+            pass
+        assert time.monotonic() - started < 5
+    finally:
+        release.set()
+
+
+def test_sharded_mode_skips_warm_up_and_reports_shards(monkeypatch):
+    distributor = FakeDistributor(shards=2, alive=2)
+    monkeypatch.setattr(main, "init_db", lambda: True)
+    monkeypatch.setattr(main, "_start_shards", lambda shards: distributor)
+    warm_ups = []
+    monkeypatch.setattr(main, "_warm_up", warm_ups.append)
+    with TestClient(main.create_app(shards=2)) as client:
+        body = client.get("/health/ready").json()
+        assert (body['status'], body['shards_alive']) == ("ready", 2)
+        distributor.alive = 1
+        assert client.get("/health/ready").json()['status'] == "degraded"
+    assert distributor.stopped
+    assert warm_ups == []
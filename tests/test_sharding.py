@@ -0,0 +1,151 @@
+import os
+import signal
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from app.models import LeadContact, Operator, OperatorCompetence, Source
+from app.sharding import ShardState, ShardedDistributor, plan_shards
+from app.main import _check_shard_mode
+
+
+def add_config(db, sources, competences, max_load=1):
+    """sources - число источников, competences - пары (operator_id, source_id, weight)"""
+    db.add_all([Source(name=f"s{i}") for i in range(1, sources + 1)])
+    operator_ids = sorted({op for op, _, _ in competences})
+    db.add_all([Operator(id=op, name=f"o{op}", email=f"o{op}@test", max_load=max_load) for op in operator_ids])
+    db.add_all([OperatorCompetence(operator_id=op, source_id=src, weight=w) for op, src, w in competences])
+    db.commit()
+
+
+def test_sources_sharing_operators_land_on_same_shard(db):
+    # o1: s1-s2, o2: s2-s3 - одна компонента; s4 - своя; s5 без операторов
+    add_config(db, 5, [(1, 1, 1), (1, 2, 1), (2, 2, 1), (2, 3, 1), (3, 4, 1)])
+    placement = plan_shards(db, 3)
+
+    assert set(placement) == {1, 2, 3, 4, 5}
+    assert placement[1] == placement[2] == placement[3]
+    assert placement[4] != placement[1]
+    assert placement[5] != placement[1]
+
+
+def test_placement_balances_components(db):
+    add_config(db, 4, [(1, 1, 1), (2, 2, 1), (3, 3, 1), (4, 4, 1)])
+    assert sorted(plan_shards(db, 2).values()) == [0, 0, 1, 1]
+
+
+def test_shard_state_respects_max_load_and_resyncs(db):
+    add_config(db, 1, [(1, 1, 1)])
+    state = ShardState()
+    state.assign(db, [1])
+
+    first, operator = state.distribute(db, 1, "a")
+    assert operator['id'] == 1
+    second, operator = state.distribute(db, 1, "b")
+    assert operator is None and second['status'] == "no_operator"
+
+    # Обращение закрыто вне шарда - до синхронизации оператор еще считается занятым
+    db.query(LeadContact).filter(LeadContact.id == first['id']).update({"status": "closed"})
+    db.commit()
+    assert state.distribute(db, 1, "c")[1] is None
+    state.sync_load(db)
+    assert state.distribute(db, 1, "d")[1]['id'] == 1
+
+
+def test_shard_state_reload_picks_up_operator_changes(db):
+    add_config(db, 1, [(1, 1, 1), (2, 1, 1)], max_load=10)
+    state = ShardState()
+    state.assign(db, [1])
+    db.query(Operator).filter(Operator.id == 1).update({"is_active": False})
+    db.commit()
+    state.assign(db, [1])
+    assert {state.distribute(db, 1, f"x{i}")[1]['id'] for i in range(5)} == {2}
+
+
+def test_check_shard_mode_rejects_multiple_workers(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "4")
+    with pytest.raises(RuntimeError):
+        _check_shard_mode(2)
+    _check_shard_mode(0)
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    _check_shard_mode(2)
+
+
+def test_sharded_distributor_end_to_end(tmp_path, monkeypatch, make_session):
+    url = f"sqlite:///{tmp_path / 'shards.db'}"
+    # Процессы-шарды запускаются через spawn и берут адрес БД из окружения
+    monkeypatch.setenv("DATABASE_URL", url)
+    db = make_session(url)
+    add_config(db, 2, [(1, 1, 1), (2, 2, 1)])
+    lock_path = str(tmp_path / "shards.lock")
+
+    distributor = ShardedDistributor(2, sync_interval=3600, lock_path=lock_path)
+    distributor.start(db)
+    try:
+        assert distributor.placement[1] != distributor.placement[2]
+        contact, operator = distributor.distribute(1, "a")
+        assert operator['id'] == 1
+        assert distributor.distribute(1, "b")[1] is None
+        assert distributor.distribute(2, "c")[1]['id'] == 2
+
+        # Второй владелец тех же операторов не стартует
+        with pytest.raises(RuntimeError):
+            ShardedDistributor(1, lock_path=lock_path).start(db)
+
+        db.query(LeadContact).filter(LeadContact.id == contact['id']).update({"status": "closed"})
+        db.commit()
+        distributor.sync_load()
+        assert distributor.distribute(1, "d")[1]['id'] == 1
+
+        db.query(Operator).filter(Operator.id == 1).update({"max_load": 3})
+        db.commit()
+        distributor.reload(db)
+        assert distributor.distribute(1, "e")[1]['id'] == 1
+    finally:
+        distributor.stop()
+
+
+def test_dead_shard_fails_fast_and_is_respawned(tmp_path, monkeypatch, make_session):
+    url = f"sqlite:///{tmp_path / 'shards.db'}"
+    monkeypatch.setenv("DATABASE_URL", url)
+    db = make_session(url)
+    add_config(db, 2, [(1, 1, 1), (2, 2, 1)], max_load=10)
+
+    distributor = ShardedDistributor(2, sync_interval=3600, lock_path=str(tmp_path / "shards.lock"))
+    distributor.start(db)
+    try:
+        shard = distributor.placement[1]
+        distributor._processes[shard].kill()
+        distributor._processes[shard].join()
+        assert distributor.alive_shards() == 1
+
+        # Ожидание ответа от умершего процесса не висит до таймаута
+        started = time.monotonic()
+        with pytest.raises(RuntimeError):
+            distributor._submit(shard, "sync", None).result(10)
+        assert time.monotonic() - started < 5
+
+        # Следующее обращение перезапускает шард с его источниками
+        assert distributor.distribute(1, "a")[1]['id'] == 1
+        assert distributor.alive_shards() == 2
+    finally:
+        distributor.stop()
+
+
+def test_stop_does_not_hang_on_stuck_shard(tmp_path, monkeypatch, make_session):
+    url = f"sqlite:///{tmp_path / 'shards.db'}"
+    monkeypatch.setenv("DATABASE_URL", url)
+    db = make_session(url)
+    add_config(db, 1, [(1, 1, 1)])
+
+    distributor = ShardedDistributor(1, sync_interval=3600, lock_path=str(tmp_path / "shards.lock"))
+    distributor.start(db)
+    process = distributor._processes[0]
+    os.kill(process.pid, signal.SIGSTOP)
+
+    started = time.monotonic()
+    distributor.stop(timeout=1)
+    assert not process.is_alive()
+    assert time.monotonic() - started < 10